@@ -1,15 +1,20 @@
 # app.py
 
 import streamlit as st
-from rag_pipeline import load_documents, create_temp_qa_chain, generate_suggestions, extract_legal_glossary
-import tempfile, os, io
+from rag_pipeline import get_embeddings_model, get_llm_model, get_spacy_model, load_uploaded_documents, build_chain_cached, build_glossary_cached, generate_suggestions
+import io, hashlib, gc, asyncio
 from streamlit_mic_recorder import mic_recorder
 import speech_recognition as sr
 from pydub import AudioSegment
 from pydub.utils import which
+try:
+    import av
+except ImportError:
+    av = None
 import streamlit.components.v1 as components
 from html import escape
 from transformers import pipeline
+import torch
 
 # ------------------- Page Config -------------------
 st.set_page_config(page_title="Justify", layout="centered")
@@ -31,8 +36,15 @@ for key in ["chat_history", "chat_chain", "chat_memory", "suggestions", "llm", "
 
 # ------------------- Cached Translator -------------------
 @st.cache_resource
+def get_translator_cache():
+    """Process-wide {model_name: translation pipeline}, shared by every session."""
+    return {}
+
 def get_translator(model_name):
-    return pipeline("translation", model=model_name)
+    translators = get_translator_cache()
+    if model_name not in translators:
+        translators[model_name] = pipeline("translation", model=model_name)
+    return translators[model_name]
 
 lang_map = {
     "Spanish": "Helsinki-NLP/opus-mt-en-es",
@@ -41,13 +53,14 @@ lang_map = {
     "Hindi": "Helsinki-NLP/opus-mt-en-hi"
 }
 
-# ✅ Initialize target_lang and translator if missing
+@st.cache_data(show_spinner=False, max_entries=512)
+def translate(text, lang):
+    return get_translator(lang_map[lang])(text)[0]['translation_text']
+
+# ✅ Initialize target_lang (the translator itself loads lazily on the first answer)
 if "target_lang" not in st.session_state:
     st.session_state.target_lang = "Spanish"
 
-if "translator" not in st.session_state:
-    st.session_state.translator = get_translator(lang_map[st.session_state.target_lang])
-
 # ------------------- Language Selector -------------------
 st.sidebar.markdown("### 🌐 Translate Answers")
 lang_option = st.sidebar.selectbox(
@@ -57,10 +70,14 @@ lang_option = st.sidebar.selectbox(
     key="target_language_selectbox"
 )
 
-# ✅ Reload translator when language changes
+# ✅ Unload the previous translator when language changes. Only that model is dropped;
+# the cache is process-wide, so other sessions on that language reload it lazily.
 if st.session_state.target_lang != lang_option:
+    get_translator_cache().pop(lang_map[st.session_state.target_lang], None)
     st.session_state.target_lang = lang_option
-    st.session_state.translator = get_translator(lang_map[lang_option])
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
 
 # ------------------- Chat Response Function -------------------
 def handle_user_input(user_input):
@@ -79,7 +96,11 @@ def handle_user_input(user_input):
 
         # ✅ Safe translation
         try:
-            translated = st.session_state.translator(answer)[0]['translation_text']
+            # Answers without any letters (numbers, dates, section refs) need no MT model
+            if not any(c.isalpha() for c in answer):
+                translated = answer
+            else:
+                translated = translate(answer, st.session_state.target_lang)
         except Exception:
             translated = "(Translation unavailable)"
 
@@ -118,32 +139,80 @@ def handle_user_input(user_input):
         st.session_state.chat_history.append({"role": "assistant", "content": answer})
         st.session_state.chat_memory.append((user_input, answer))
 
+# ------------------- Audio Decoding -------------------
+SPEECH_SAMPLE_RATE = 16000
+
+def decode_audio(audio_bytes):
+    """
+    Decodes the recorded webm clip into sr.AudioData.
+    Uses PyAV in-process when available; otherwise falls back to pydub (ffmpeg subprocess).
+    """
+    if av is None:
+        AudioSegment.converter = which("ffmpeg")
+        AudioSegment.ffprobe = which("ffprobe")
+        audio_segment = AudioSegment.from_file(io.BytesIO(audio_bytes), format="webm").set_channels(1)
+        # AudioSegment already holds raw (mono) PCM; skip the WAV export/re-parse round-trip
+        return sr.AudioData(audio_segment.raw_data, audio_segment.frame_rate, audio_segment.sample_width)
+
+    # Resample straight to 16-bit mono PCM, the layout sr.AudioData expects
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=SPEECH_SAMPLE_RATE)
+    pcm_chunks = []
+    with av.open(io.BytesIO(audio_bytes), format="webm") as container:
+        for frame in container.decode(audio=0):
+            for pcm_frame in resampler.resample(frame):
+                pcm_chunks.append(pcm_frame.to_ndarray().tobytes())
+    for pcm_frame in resampler.resample(None):
+        pcm_chunks.append(pcm_frame.to_ndarray().tobytes())
+    return sr.AudioData(b"".join(pcm_chunks), SPEECH_SAMPLE_RATE, 2)
+
+# ------------------- Concurrent Document Processing -------------------
+async def process_documents(docs, doc_hashes, with_suggestions):
+    """
+    Builds the QA chain, suggestions and glossary concurrently; the three stages share no state.
+    Returns (chain, llm, suggestions, glossary); suggestions is None unless requested.
+    """
+    llm = get_llm_model()
+    chain_task = asyncio.to_thread(build_chain_cached, doc_hashes, docs)
+    glossary_task = asyncio.to_thread(build_glossary_cached, doc_hashes, docs)
+    if with_suggestions:
+        suggestions_task = asyncio.to_thread(generate_suggestions, docs, llm)
+    else:
+        suggestions_task = asyncio.sleep(0, result=None)
+
+    (chain, llm), suggestions, glossary = await asyncio.gather(chain_task, suggestions_task, glossary_task)
+    return chain, llm, suggestions, glossary
+
 # ------------------- Upload PDFs -------------------
 uploaded_files = st.file_uploader("Upload one or more PDF documents", type=["pdf"], accept_multiple_files=True)
 
 if uploaded_files:
-    all_docs = []
-    temp_paths = []
-
+    files = []
     for uploaded_file in uploaded_files:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            temp_paths.append(tmp_file.name)
-        all_docs.extend(load_documents(temp_paths[-1]))
+        data = uploaded_file.getvalue()
+        files.append((hashlib.sha256(data).hexdigest(), data, uploaded_file.name))
+    # Order-insensitive: re-selecting the same PDFs in another order reuses the cached index.
+    # Names are part of the key (as in the parse cache) since they become metadata["source"].
+    doc_hashes = tuple(sorted((digest, name) for digest, _, name in files))
+
+    # Files seen on an earlier rerun come straight from the cache; new ones are parsed in parallel
+    all_docs = load_uploaded_documents(files)
 
     st.success(f"Uploaded and processed {len(uploaded_files)} file(s).")
     
-    # Update chain + llm
-    st.session_state.chat_chain, st.session_state.llm = create_temp_qa_chain(all_docs)
-
-    # Generate suggestions only on initial upload
-    if not st.session_state.get("uploaded_files_count") == len(uploaded_files):
-        with st.spinner("Generating contextual questions..."):
-            st.session_state.suggestions = generate_suggestions(all_docs, st.session_state.llm)
-            st.session_state.uploaded_files_count = len(uploaded_files)
-
-    # Generate Legal Glossary
-    st.session_state.glossary = extract_legal_glossary(all_docs)
+    # Load models on the script thread so worker threads only ever hit the resource cache
+    get_embeddings_model()
+    get_llm_model()
+    get_spacy_model()
+
+    # Update chain + llm and the legal glossary; generate suggestions only on initial upload
+    new_upload = not st.session_state.get("uploaded_files_count") == len(uploaded_files)
+    with st.spinner("Generating contextual questions..." if new_upload else "Processing documents..."):
+        chain, llm, suggestions, glossary = asyncio.run(process_documents(all_docs, doc_hashes, new_upload))
+    st.session_state.chat_chain, st.session_state.llm = chain, llm
+    st.session_state.glossary = glossary
+    if new_upload:
+        st.session_state.suggestions = suggestions
+        st.session_state.uploaded_files_count = len(uploaded_files)
 
     # Sidebar: Legal Glossary
     with st.sidebar.expander("📖 Legal Glossary", expanded=True):
@@ -186,33 +255,23 @@ if uploaded_files:
 
     if audio:
         recognizer = sr.Recognizer()
-        audio_bytes = io.BytesIO(audio["bytes"])
-
-        AudioSegment.converter = which("ffmpeg")
-        AudioSegment.ffprobe = which("ffprobe")
 
         try:
-            audio_segment = AudioSegment.from_file(audio_bytes, format="webm")
+            audio_data = decode_audio(audio["bytes"])
         except Exception as e:
             st.error(f"Could not decode audio: {e}")
-            audio_segment = None
-
-        if audio_segment:
-            wav_io = io.BytesIO()
-            audio_segment.export(wav_io, format="wav")
-            wav_io.seek(0)
-
-            with sr.AudioFile(wav_io) as source:
-                audio_data = recognizer.record(source)
-                try:
-                    text = recognizer.recognize_google(audio_data)
-                    st.success("Voice captured successfully!")
-                    st.write("What You Said:", f"`{text}`")
-                    handle_user_input(text)
-                except sr.UnknownValueError:
-                    st.error("Could not understand the audio.")
-                except sr.RequestError:
-                    st.error("Could not reach Google Speech Recognition service.")
+            audio_data = None
+
+        if audio_data:
+            try:
+                text = recognizer.recognize_google(audio_data)
+                st.success("Voice captured successfully!")
+                st.write("What You Said:", f"`{text}`")
+                handle_user_input(text)
+            except sr.UnknownValueError:
+                st.error("Could not understand the audio.")
+            except sr.RequestError:
+                st.error("Could not reach Google Speech Recognition service.")
 
     # Manual Text Input
     user_input = st.chat_input("Ask a question...")
@@ -224,12 +283,5 @@ if uploaded_files:
         chat_log = "\n\n".join([f"{m['role'].upper()}: {m['content']}" for m in st.session_state.chat_history])
         st.download_button("Download Chat", data=chat_log, file_name="legal_chat_history.txt", mime="text/plain")
 
-    # Cleanup Temp Files
-    for path in temp_paths:
-        try:
-            os.remove(path)
-        except Exception as e:
-            print(f"Warning: Could not delete {path} — {e}")
-
 else:
     st.warning("Upload at least one PDF to begin.")
@@ -2,40 +2,283 @@
 
 import streamlit as st
 from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import CharacterTextSplitter
+from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.chains import ConversationalRetrievalChain
 from langchain_community.llms import HuggingFacePipeline
 from transformers import pipeline
+import torch
+import faiss
+import numpy as np
+import xxhash
+import tempfile, os, shutil, threading
 import re
 import random
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import spacy
 
+_SECTION_RE = re.compile(r'(?:Section|Sec\.?)\s*\d+', re.IGNORECASE)
+_NUMBERED_ITEM_RE = re.compile(r'^\s*\d+[\.\)]\s*(.+)')
+_ENUMERATOR_RE = re.compile(r'^\(?(?:\d{1,3}|[a-z]{1,2}|[ivxlc]+)[\.\)](?:\s|$)', re.IGNORECASE)
+
 # ------------------- Caching Models and Components -------------------
+def optimize_for_cpu(model):
+    """
+    Applies Intel Extension for PyTorch operator fusion to a torch model for CPU inference.
+    Returns the model unchanged on GPU or when IPEX is not installed.
+    """
+    if torch.cuda.is_available():
+        return model
+    try:
+        import intel_extension_for_pytorch as ipex
+    except ImportError:
+        return model
+    return ipex.optimize(model.eval(), dtype=torch.float32)
+
+class FastEmbed(Embeddings):
+    """LangChain wrapper around fastembed's ONNX Runtime embedding models (plain FP32 export for MiniLM)."""
+
+    def __init__(self, model_name, batch_size=64):
+        from fastembed import TextEmbedding
+        self._model = TextEmbedding(model_name)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts):
+        return [vector.tolist() for vector in self._model.embed(texts, batch_size=self.batch_size)]
+
+    def embed_query(self, text):
+        return next(iter(self._model.query_embed([text]))).tolist()
+
 @st.cache_resource
 def get_embeddings_model():
-    return HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    try:
+        return FastEmbed("sentence-transformers/all-MiniLM-L6-v2")
+    except Exception as e:
+        print(f"Warning: fastembed unavailable, falling back to PyTorch embeddings — {e}")
+
+    embeddings = HuggingFaceEmbeddings(
+        model_name="all-MiniLM-L6-v2",
+        model_kwargs={"device": "cuda" if torch.cuda.is_available() else "cpu"},
+        encode_kwargs={"batch_size": 64, "normalize_embeddings": True}
+    )
+    embeddings.client = optimize_for_cpu(embeddings.client)
+    return embeddings
+
+LLM_MODEL_NAME = "google/flan-t5-small"
+MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".model_cache")
+QUANTIZED_LLM_DIR = os.path.join(MODEL_CACHE_DIR, "flan-t5-small-int8")
+QUANTIZED_LLM_FILES = {
+    "encoder_file_name": "encoder_model_quantized.onnx",
+    "decoder_file_name": "decoder_model_quantized.onnx",
+    "decoder_with_past_file_name": "decoder_with_past_model_quantized.onnx"
+}
+
+def export_quantized_llm():
+    """
+    Exports flan-t5 to ONNX and quantizes it into a scratch dir, which is only moved
+    into QUANTIZED_LLM_DIR once every graph and the tokenizer have been written.
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=MODEL_CACHE_DIR)
+    try:
+        onnx_dir = os.path.join(work_dir, "onnx")
+        int8_dir = os.path.join(work_dir, "int8")
+        ORTModelForSeq2SeqLM.from_pretrained(LLM_MODEL_NAME, export=True).save_pretrained(onnx_dir)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        # Encoder and decoder(s) are separate ONNX graphs, each quantized on its own
+        for file_name in os.listdir(onnx_dir):
+            if file_name.endswith(".onnx"):
+                quantizer = ORTQuantizer.from_pretrained(onnx_dir, file_name=file_name)
+                quantizer.quantize(save_dir=int8_dir, quantization_config=qconfig)
+        AutoTokenizer.from_pretrained(LLM_MODEL_NAME).save_pretrained(int8_dir)
+
+        missing = [f for f in QUANTIZED_LLM_FILES.values() if not os.path.exists(os.path.join(int8_dir, f))]
+        if missing:
+            raise RuntimeError(f"Quantization did not produce {missing}")
+        # Drop any leftover partial export before swapping the finished one in
+        shutil.rmtree(QUANTIZED_LLM_DIR, ignore_errors=True)
+        os.replace(int8_dir, QUANTIZED_LLM_DIR)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def load_quantized_llm():
+    """
+    Loads the dynamic int8 ONNX export of flan-t5, creating it on first use (cached on disk).
+    Returns (model, tokenizer) usable by a transformers pipeline.
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    from transformers import AutoTokenizer
+
+    if not all(os.path.exists(os.path.join(QUANTIZED_LLM_DIR, f)) for f in QUANTIZED_LLM_FILES.values()):
+        export_quantized_llm()
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(QUANTIZED_LLM_DIR, **QUANTIZED_LLM_FILES)
+    return model, AutoTokenizer.from_pretrained(QUANTIZED_LLM_DIR)
 
 @st.cache_resource
 def get_llm_model():
-    pipe = pipeline("text2text-generation", model="google/flan-t5-small", max_new_tokens=256)
+    try:
+        model, tokenizer = load_quantized_llm()
+        pipe = pipeline("text2text-generation", model=model, tokenizer=tokenizer, max_new_tokens=256)
+    except Exception as e:
+        print(f"Warning: int8 LLM unavailable, falling back to FP32 — {e}")
+        pipe = pipeline("text2text-generation", model=LLM_MODEL_NAME, max_new_tokens=256)
+        pipe.model = optimize_for_cpu(pipe.model)
     return HuggingFacePipeline(pipeline=pipe)
 
 # ------------------- Load & Split Documents -------------------
+CHUNK_SIZE = 1400
+CHUNK_OVERLAP = 280  # 20% overlap
+MIN_PAGE_CHARS = 50
+
+def _edge_candidates(lines):
+    """First and last line of a page, skipping enumerators like "(a)" or "1." that are body text."""
+    edges = {0, len(lines) - 1} if lines else set()
+    return {i for i in edges if not _ENUMERATOR_RE.match(lines[i].strip())}
+
+def clean_pages(docs):
+    """
+    Strips running headers/footers, i.e. a page's first or last line when the same line
+    sits at a page edge on at least half of the pages, and drops pages left (near-)empty.
+    """
+    page_lines = [doc.page_content.splitlines() for doc in docs]
+    repeated = set()
+    if len(docs) >= 3:
+        line_counts = Counter(
+            line for lines in page_lines
+            for line in {lines[i].strip() for i in _edge_candidates(lines)} if line
+        )
+        repeated = {line for line, n in line_counts.items() if n >= len(docs) / 2}
+
+    cleaned = []
+    for doc, lines in zip(docs, page_lines):
+        edges = _edge_candidates(lines)
+        kept = [l for i, l in enumerate(lines) if not (i in edges and l.strip() in repeated)]
+        doc.page_content = "\n".join(kept).strip()
+        if len(doc.page_content) >= MIN_PAGE_CHARS:
+            cleaned.append(doc)
+    return cleaned
+
 def load_documents(file_path):
     loader = PyPDFLoader(file_path)
-    docs = loader.load()
+    docs = clean_pages(loader.load())
     for doc in docs:
         doc.metadata["source"] = file_path.split("/")[-1]
-    splitter = CharacterTextSplitter(chunk_size=500, chunk_overlap=50)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
     return splitter.split_documents(docs)
 
+def load_pdf_bytes(file_bytes, name):
+    """Parses raw PDF bytes via a temp file; top-level so a process pool can pickle it."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        tmp_file.write(file_bytes)
+        temp_path = tmp_file.name
+    try:
+        docs = load_documents(temp_path)
+    finally:
+        try:
+            os.remove(temp_path)
+        except Exception as e:
+            print(f"Warning: Could not delete {temp_path} — {e}")
+    for doc in docs:
+        doc.metadata["source"] = name
+    return docs
+
+PARSED_CACHE_MAX_FILES = 32
+
+@st.cache_resource
+def get_parsed_documents_cache():
+    """Process-wide LRU of parsed uploads keyed on (sha256, file name), plus its lock."""
+    return OrderedDict(), threading.Lock()
+
+def load_uploaded_documents(files):
+    """
+    files: list of (sha256, file_bytes, name).
+    Returns the chunks of all files; only cache misses are parsed, in a process pool when
+    there are several (pypdf is pure Python, so threads would serialize on the GIL).
+    Workers are spawned rather than forked: the Streamlit server is multithreaded and other
+    sessions may be running ORT/torch threads, and fork from a threaded process can deadlock
+    on held locks. Each worker pays the module import cost once.
+    """
+    cache, lock = get_parsed_documents_cache()
+    keys = [(digest, name) for digest, _, name in files]
+    with lock:
+        misses = {key: data for key, (_, data, _) in zip(keys, files) if key not in cache}
+
+    if len(misses) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(len(misses), os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            parsed = list(executor.map(load_pdf_bytes, misses.values(), [name for _, name in misses]))
+    else:
+        parsed = [load_pdf_bytes(data, name) for (_, name), data in misses.items()]
+
+    all_docs = []
+    with lock:
+        cache.update(zip(misses, parsed))
+        for key in keys:
+            cache.move_to_end(key)
+            all_docs.extend(cache[key])
+        while len(cache) > PARSED_CACHE_MAX_FILES:
+            cache.popitem(last=False)
+    return all_docs
+
 # ------------------- Create Conversational RAG Chain -------------------
+IVFPQ_MIN_CHUNKS = 1000  # below this a flat index is both fast enough and exact
+IVFPQ_SUBQUANTIZERS = 16
+IVFPQ_BITS = 8
+IVFPQ_NPROBE = 8
+
+def dedupe_documents(documents):
+    """Drops chunks whose text already appeared (shared boilerplate, re-uploaded amendments)."""
+    seen = set()
+    unique = []
+    for doc in documents:
+        digest = xxhash.xxh64(doc.page_content).intdigest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(doc)
+    return unique
+
+def build_vector_store(documents, embeddings):
+    # Embed every chunk from every uploaded PDF in one batched call
+    texts = [doc.page_content for doc in documents]
+    metadatas = [doc.metadata for doc in documents]
+    vectors = embeddings.embed_documents(texts)
+
+    if len(vectors) < IVFPQ_MIN_CHUNKS:
+        return FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas)
+
+    # Large corpora: IVF-PQ trades a little recall for sub-linear search and compact codes
+    matrix = np.asarray(vectors, dtype="float32")
+    dim = matrix.shape[1]
+    quantizer = faiss.IndexFlatL2(dim)
+    index = faiss.IndexIVFPQ(quantizer, dim, min(100, len(matrix) // 40), IVFPQ_SUBQUANTIZERS, IVFPQ_BITS)
+    index.train(matrix)
+    index.add(matrix)
+    index.nprobe = IVFPQ_NPROBE
+
+    docstore = InMemoryDocstore({str(i): doc for i, doc in enumerate(documents)})
+    index_to_docstore_id = {i: str(i) for i in range(len(documents))}
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
 def create_temp_qa_chain(documents):
     embeddings = get_embeddings_model()
     llm = get_llm_model()
-    db = FAISS.from_documents(documents, embeddings)
+    db = build_vector_store(dedupe_documents(documents), embeddings)
     retriever = db.as_retriever()
     
     chain = ConversationalRetrievalChain.from_llm(
@@ -45,14 +288,20 @@ def create_temp_qa_chain(documents):
     )
     return chain, llm
 
-# ------------------- Generate Contextual Suggestions -------------------
-def generate_suggestions(docs, llm):
-    all_questions = []
+CHAIN_CACHE_MAX_ENTRIES = 4
+CHAIN_CACHE_TTL = 3600  # seconds
 
-    for i, doc in enumerate(docs):
-        context_text = doc.page_content[:1500]
+@st.cache_resource(show_spinner=False, max_entries=CHAIN_CACHE_MAX_ENTRIES, ttl=CHAIN_CACHE_TTL)
+def build_chain_cached(doc_hashes, _documents):
+    """Reuse the FAISS index + chain while the set of uploaded files is unchanged."""
+    return create_temp_qa_chain(_documents)
+
+# ------------------- Generate Contextual Suggestions -------------------
+SUGGESTION_DOC_LIMIT = 10  # only 8–10 questions are kept, so a handful of chunks is enough
+SUGGESTION_BATCH_SIZE = 4
 
-        prompt = f"""
+def build_suggestion_prompt(context_text):
+    return f"""
         You are given part of a legal/official/government document.
 
         Task: Generate **exactly 5 unique FAQ-style questions** based only on this text.
@@ -68,19 +317,42 @@ def generate_suggestions(docs, llm):
         Questions:
         """
 
-        raw_output = str(llm.invoke(prompt)).strip()
-        print(f"\n--- DEBUG RAW SUGGESTIONS (Doc {i+1}) ---")
-        print(raw_output)
-        print("----------------------------------------\n")
+def parse_questions(raw_output):
+    # Single pass: numbered items win; bare lines are the fallback when nothing is numbered
+    numbered, plain = [], []
+    for line in raw_output.splitlines():
+        match = _NUMBERED_ITEM_RE.match(line)
+        if match:
+            numbered.append(match.group(1))
+        elif line.strip():
+            plain.append(line.strip("-•*1234567890. "))
+
+    questions = numbered or plain
+    return [q.strip() for q in questions if len(q.split()) <= 12 and q.endswith("?")]
+
+def generate_suggestions(docs, llm):
+    all_questions = []
+
+    # Sample chunks from across the document, then prompt them batch by batch
+    # until enough questions are collected
+    docs = random.sample(docs, min(SUGGESTION_DOC_LIMIT, len(docs)))
+    for start in range(0, len(docs), SUGGESTION_BATCH_SIZE):
+        batch = docs[start:start + SUGGESTION_BATCH_SIZE]
+        prompts = [build_suggestion_prompt(doc.page_content[:1500]) for doc in batch]
+        outputs = llm.pipeline(prompts, batch_size=SUGGESTION_BATCH_SIZE)
 
-        questions = re.findall(r'^\s*\d+[\.\)]\s*(.+)', raw_output, flags=re.MULTILINE)
-        if not questions:
-            questions = [line.strip("-•*1234567890. ") 
-                         for line in raw_output.splitlines() if line.strip()]
+        for i, output in enumerate(outputs, start):
+            if isinstance(output, list):
+                output = output[0]
+            raw_output = output["generated_text"].strip()
+            print(f"\n--- DEBUG RAW SUGGESTIONS (Doc {i+1}) ---")
+            print(raw_output)
+            print("----------------------------------------\n")
 
-        questions = [q.strip() for q in questions if len(q.split()) <= 12 and q.endswith("?")]
+            all_questions.extend(parse_questions(raw_output)[:5])  # add up to 5 from this doc
 
-        all_questions.extend(questions[:5])  # add up to 5 from this doc
+        if len(all_questions) >= 10:
+            break
 
     # ✅ Keep only 8–10 questions total
     if len(all_questions) > 10:
@@ -112,6 +384,14 @@ def get_spacy_model():
         download("en_core_web_sm")
         return spacy.load("en_core_web_sm")
 
+GLOSSARY_CATEGORIES = ['Acts/Laws', 'Authorities', 'Dates', 'Sections', 'Concepts']
+ENTITY_LABEL_CATEGORIES = {
+    'LAW': 'Acts/Laws',
+    'ORG': 'Authorities',
+    'GPE': 'Authorities',
+    'DATE': 'Dates'
+}
+
 def extract_legal_glossary(documents):
     """
     Returns a list of tuples: (source_file, glossary_dict)
@@ -120,41 +400,39 @@ def extract_legal_glossary(documents):
     nlp = get_spacy_model()
     results = []
 
-    for doc in documents:
-        text = doc.page_content
-        source = doc.metadata.get("source", "Unknown")
-        glossary = {
-            'Acts/Laws': [],
-            'Authorities': [],
-            'Dates': [],
-            'Sections': [],
-            'Concepts': []
-        }
-
-        spacy_doc = nlp(text)
+    texts = [doc.page_content for doc in documents]
+    sources = [doc.metadata.get("source", "Unknown") for doc in documents]
+    # Single process on purpose: this runs in a worker thread next to the embedding/LLM
+    # threads, and forking a spaCy pool from a threaded process can deadlock on held locks
+    spacy_docs = nlp.pipe(texts, batch_size=32, disable=["lemmatizer"])
+
+    for spacy_doc, source in zip(spacy_docs, sources):
+        # Insertion-ordered dicts keyed on the casefolded text dedupe "Section 3" / "section 3"
+        glossary = {k: {} for k in GLOSSARY_CATEGORIES}
 
         for ent in spacy_doc.ents:
             label = ent.label_
             token_text = ent.text.strip()
 
             # Map spaCy entity labels to glossary categories
-            if label in ['LAW']:
-                glossary['Acts/Laws'].append(token_text)
-            elif label in ['ORG', 'GPE']:
-                glossary['Authorities'].append(token_text)
-            elif label in ['DATE']:
-                glossary['Dates'].append(token_text)
-            elif re.match(r'(Section|Sec\.?)\s*\d+', token_text, re.IGNORECASE):
-                glossary['Sections'].append(token_text)
+            category = ENTITY_LABEL_CATEGORIES.get(label)
+            if category:
+                glossary[category].setdefault(token_text.casefold(), token_text)
+            elif _SECTION_RE.match(token_text):
+                glossary['Sections'].setdefault(token_text.casefold(), token_text)
             else:
                 # treat proper nouns not already captured as Concepts
-                if ent.root.pos_ in ['PROPN', 'NOUN'] and len(token_text.split()) <= 4:
-                    glossary['Concepts'].append(token_text)
+                if ent.root.pos_ in ('PROPN', 'NOUN') and len(token_text.split()) <= 4:
+                    glossary['Concepts'].setdefault(token_text.casefold(), token_text)
 
-        # Deduplicate lists
-        for k in glossary.keys():
-            glossary[k] = list(set(glossary[k]))
-
-        results.append((source, glossary))
+        results.append((source, {k: list(v.values()) for k, v in glossary.items()}))
 
     return results
+
+@st.cache_data(show_spinner=False, max_entries=CHAIN_CACHE_MAX_ENTRIES, ttl=CHAIN_CACHE_TTL)
+def build_glossary_cached(doc_hashes, _documents):
+    """
+    Reuse the glossary while the set of uploaded files is unchanged.
+    doc_hashes holds (digest, name) pairs, so renamed re-uploads get fresh source headings.
+    """
+    return extract_legal_glossary(_documents)